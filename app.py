@@ -1,19 +1,85 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, request, send_file, jsonify, Response, stream_with_context
+from flask.json.provider import JSONProvider
 import yt_dlp
 import os
+import sys
 import tempfile
+import atexit
+import queue
 import shutil
+import subprocess
 import logging
 import re
+import copy
+import collections
+import contextlib
+import json
+import hashlib
+import threading
+import time
+import unicodedata
+from urllib.parse import quote
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import cachetools
+import orjson
+import urllib3
+from yt_dlp.networking.common import register_rh, register_preference
+from yt_dlp.networking._requests import RequestsRH, RequestsHTTPAdapter
+from yt_dlp.extractor.youtube import YoutubeIE
+from yt_dlp.extractor.instagram import InstagramIE
+from zipstream import ZipStream
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (set LOG_LEVEL=INFO for per-request logs)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper())
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson, used by jsonify and request.get_json
+    """
+    mimetype = 'application/json'
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Skip the bytes -> str -> bytes round trip of the default implementation
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Supported video qualities (for YouTube), in display order
+QUALITY_ORDER = ('144', '240', '360', '480', '540', '720', '1080', '1440', '2160', 'best', 'worst')
+SUPPORTED_QUALITIES = frozenset(QUALITY_ORDER)
+SUPPORTED_QUALITIES_STR = ', '.join(QUALITY_ORDER)
 
-# Supported video qualities (for YouTube)
-SUPPORTED_QUALITIES = ['144', '240', '360', '480', '540', '720', '1080', '1440', '2160', 'best', 'worst']
+# Up to this height YouTube may serve pre-muxed progressive mp4s, which need
+# no ffmpeg merge and can be streamed straight to the client
+PROGRESSIVE_MAX_HEIGHT = 720
+
+def _quality_format(q):
+    """
+    Build the YouTube format selector for a numeric quality
+    """
+    split = f'bestvideo[height<={q}][ext=mp4]+bestaudio[ext=m4a]/best[height<={q}][ext=mp4]/best'
+    if int(q) > PROGRESSIVE_MAX_HEIGHT:
+        return split
+    # Only take a progressive stream at exactly the requested height, so it
+    # never replaces a taller split stream
+    return f'best[height={q}][ext=mp4][acodec!=none][vcodec!=none]/{split}'
+
+# YouTube format selector for each supported quality
+_FORMAT_BY_QUALITY = {
+    # Specific quality (144, 240, 360, 480, 540, 720, 1080, etc.)
+    **{q: _quality_format(q) for q in QUALITY_ORDER if q.isdigit()},
+    'best': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+    'worst': 'worstvideo[ext=mp4]+worstaudio[ext=m4a]/worst[ext=mp4]/worst',
+}
 
 # Common cookies file names to check
 COOKIES_FILES = [
@@ -24,14 +90,111 @@ COOKIES_FILES = [
     'auth_cookies.txt'
 ]
 
+# Result of the last cookies file lookup, refreshed every few seconds
+COOKIES_CACHE_TTL = 5.0
+_cookies_cache = {'checked_at': float('-inf'), 'path': None}
+
+# Extracted metadata is cached for a few minutes so /info, /formats and
+# /download on the same video share a single extraction. The cache lives in
+# each gunicorn worker process, so workers don't share entries
+INFO_CACHE_TTL = 300
+_INFO_CACHE = cachetools.TTLCache(maxsize=1024, ttl=INFO_CACHE_TTL)
+_INFO_CACHE_LOCK = threading.RLock()
+
+# Cache-Control max-age for /api/check-cookies, which reflects local files
+CHECK_COOKIES_MAX_AGE = 60
+
+# Anything other than letters, digits, underscore, space and hyphen is stripped from filenames
+_BAD_CHARS = re.compile(r'[^\w \-]', re.UNICODE)
+
+# Parallel downloads for /api/video/batch, shared across requests
+BATCH_MAX_WORKERS = 8
+BATCH_MAX_URLS = 20
+_POOL = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS)
+
+# Downloads land in a fixed pool of scratch directories. Set SCRATCH_ROOT to a
+# tmpfs path (e.g. /dev/shm/ytapi) to keep them in RAM, but size it for several
+# full videos at once: Docker's default /dev/shm is only 64MB
+SCRATCH_ROOT = os.environ.get('SCRATCH_ROOT', os.path.join(tempfile.gettempdir(), 'ytapi'))
+SCRATCH_SLOTS = 32
+
+# Seconds to wait for a free scratch directory before giving up with a 503
+SCRATCH_WAIT_TIMEOUT = 30
+
+# Downloads currently running, keyed by (video, quality, cookies file). This is
+# per worker process: identical requests only coalesce when they reach the same
+# gunicorn worker
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+# Read size for piping yt-dlp's stdout to the client
+STREAM_CHUNK_SIZE = 1 << 20
+
+# Lines of yt-dlp's stderr kept for the error message of a failed stream
+STDERR_TAIL_LINES = 20
+
+# Accepted video URLs; the named group that matches ('youtube' or 'instagram') is
+# the platform, and YouTube URLs also capture their 11-character video ID
+_URL_RE = re.compile(
+    r'^https?://(?:(?:www|m|music)\.)?(?:'
+    r'(?P<youtube>(?:youtube\.com/(?:watch\?(?:[^#]*&)?v=|shorts/|embed/|live/)'
+    r'|youtube-nocookie\.com/embed/|youtu\.be/)(?P<video_id>[\w\-]{11})(?![\w\-]))'
+    r'|(?P<instagram>instagram\.com/(?:[\w.]+/)?(?:p|reels?|tv)/[\w\-]+))',
+    re.IGNORECASE
+)
+
+# yt-dlp connection pools shared by every YoutubeDL instance in the process
+HTTP_POOL_CONNECTIONS = 32
+HTTP_POOL_MAXSIZE = 64
+_SHARED_ADAPTERS = {}
+_SHARED_ADAPTERS_LOCK = threading.Lock()
+
+class SharedHTTPAdapter(RequestsHTTPAdapter):
+    """
+    yt-dlp HTTP adapter whose connection pool outlives the YoutubeDL using it
+    """
+    def close(self):
+        # Sessions close their adapters when a YoutubeDL exits; keep the pool open
+        pass
+
+@register_rh
+class SharedPoolRequestsRH(RequestsRH):
+    """
+    yt-dlp request handler that mounts a process-wide connection pool, so
+    TCP/TLS connections to YouTube are reused across extractions
+    Cookies stay per-session; only the pooled connections are shared
+    """
+    def _create_instance(self, cookiejar, legacy_ssl_support=None):
+        session = super()._create_instance(cookiejar, legacy_ssl_support)
+        
+        if legacy_ssl_support is None:
+            legacy_ssl_support = self.legacy_ssl_support
+        key = (self.verify, self.prefer_system_certs, legacy_ssl_support,
+               self.source_address, tuple(sorted(self._client_cert.items())))
+        with _SHARED_ADAPTERS_LOCK:
+            adapter = _SHARED_ADAPTERS.get(key)
+            if adapter is None:
+                adapter = _SHARED_ADAPTERS[key] = SharedHTTPAdapter(
+                    ssl_context=self._make_sslcontext(legacy_ssl_support=legacy_ssl_support),
+                    source_address=self.source_address,
+                    max_retries=urllib3.util.retry.Retry(False),
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                )
+        
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+@register_preference(SharedPoolRequestsRH)
+def shared_pool_preference(rh, request):
+    # Rank above yt-dlp's own requests handler
+    return 200
+
 def detect_platform(url):
-    """Detect if URL is YouTube or Instagram"""
-    if 'youtube.com' in url or 'youtu.be' in url:
-        return 'youtube'
-    elif 'instagram.com' in url:
-        return 'instagram'
-    else:
-        return 'unknown'
+    """Detect if URL is YouTube or Instagram ('unknown' for anything else)"""
+    match = _URL_RE.match(url.strip())
+    return match.lastgroup if match else 'unknown'
 
 def find_cookies_file(cookies_file=None):
     """
@@ -41,28 +204,294 @@ def find_cookies_file(cookies_file=None):
     if cookies_file and os.path.exists(cookies_file):
         return cookies_file
     
-    # Check for common cookies file names
+    # Reuse the last lookup while it is fresh
+    now = time.monotonic()
+    if now - _cookies_cache['checked_at'] < COOKIES_CACHE_TTL:
+        return _cookies_cache['path']
+    
+    # List the working directory once and check for common cookies file names
+    try:
+        with os.scandir('.') as it:
+            entries = {entry.name for entry in it if entry.is_file()}
+    except OSError:
+        entries = set()
+    
+    found = None
     for cookie_file in COOKIES_FILES:
-        if os.path.exists(cookie_file):
-            logger.info(f"Using cookies file: {cookie_file}")
-            return cookie_file
+        if cookie_file in entries:
+            logger.info("Using cookies file: %s", cookie_file)
+            found = cookie_file
+            break
+    
+    _cookies_cache['path'] = found
+    _cookies_cache['checked_at'] = now
+    return found
+
+def youtube_video_id(url):
+    """
+    Get the video ID of a YouTube URL, or None for any other URL
+    """
+    match = _URL_RE.match(url.strip())
+    return match.group('video_id') if match else None
+
+def canonicalize_youtube_id(url):
+    """
+    Reduce a YouTube URL to its video ID so different URL forms share a cache entry
+    """
+    return youtube_video_id(url) or url.strip()
+
+def canonical_video_url(url):
+    """
+    Rewrite a YouTube URL to the plain watch URL of its video, dropping playlist
+    and other parameters, so what gets extracted matches the cache key
+    """
+    video_id = youtube_video_id(url)
+    if video_id:
+        return f'https://www.youtube.com/watch?v={video_id}'
+    return url.strip()
+
+def prewarm_extractors():
+    """
+    Load yt-dlp's extractor registry and the YouTube/Instagram extractors at startup
+    so the first request doesn't pay for yt-dlp's lazy loading
+    """
+    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        for ie, sample_url in ((YoutubeIE, 'https://www.youtube.com/watch?v=BOF2KmrhJfc'),
+                               (InstagramIE, 'https://www.instagram.com/p/ABC123/')):
+            ydl.get_info_extractor(ie.ie_key())
+            ie.suitable(sample_url)  # Compiles the URL pattern
+
+prewarm_extractors()
+
+def get_info(video_url, cookies_file=None):
+    """
+    Extract video metadata without downloading, reusing a cached result when available
+    """
+    canonical_url = canonical_video_url(video_url)
+    key = (canonical_url, cookies_file)
+    with _INFO_CACHE_LOCK:
+        info = _INFO_CACHE.get(key)
+    if info is not None:
+        return info
     
-    return None
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': False,
+        'noplaylist': True,  # Always the single video, never a playlist it belongs to
+    }
+    
+    if cookies_file:
+        ydl_opts['cookiefile'] = cookies_file
+    
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.sanitize_info(ydl.extract_info(canonical_url, download=False), remove_private_keys=True)
+    
+    with _INFO_CACHE_LOCK:
+        _INFO_CACHE[key] = info
+    return info
+
+def create_scratch_pool():
+    """
+    Preallocate this process's scratch directories and queue them as free
+    """
+    os.makedirs(SCRATCH_ROOT, exist_ok=True)
+    root = tempfile.mkdtemp(prefix=f'{os.getpid()}-', dir=SCRATCH_ROOT)
+    atexit.register(shutil.rmtree, root, ignore_errors=True)
+    
+    pool = queue.SimpleQueue()
+    for slot in range(SCRATCH_SLOTS):
+        path = os.path.join(root, str(slot))
+        os.mkdir(path)
+        pool.put(path)
+    return pool
+
+_SCRATCH_POOL = create_scratch_pool()
+_SCRATCH_IN_USE = set()
+_SCRATCH_LOCK = threading.Lock()
+
+class ScratchSpaceBusy(Exception):
+    """All scratch directories stayed in use for SCRATCH_WAIT_TIMEOUT seconds"""
+
+def acquire_scratch_dir():
+    """
+    Take a free scratch directory, waiting while all of them are in use
+    """
+    try:
+        temp_dir = _SCRATCH_POOL.get(timeout=SCRATCH_WAIT_TIMEOUT)
+    except queue.Empty:
+        raise ScratchSpaceBusy("Server is busy, all download slots are in use. Try again later.")
+    with _SCRATCH_LOCK:
+        _SCRATCH_IN_USE.add(temp_dir)
+    return temp_dir
+
+def release_scratch_dir(temp_dir):
+    """
+    Empty a scratch directory and return it to the pool
+    """
+    with _SCRATCH_LOCK:
+        if temp_dir not in _SCRATCH_IN_USE:
+            return  # Already released
+        _SCRATCH_IN_USE.discard(temp_dir)
+    
+    try:
+        with os.scandir(temp_dir) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
+    finally:
+        _SCRATCH_POOL.put(temp_dir)
+
+def select_format(platform, quality=None):
+    """
+    Get the yt-dlp format selector for a platform and requested quality
+    Returns the format selector and the effective quality
+    """
+    if platform == 'youtube':
+        if not quality:
+            quality = 'best'
+            
+        if quality not in SUPPORTED_QUALITIES:
+            raise ValueError(f"Unsupported quality. Use: {SUPPORTED_QUALITIES_STR}")
+        
+        return _FORMAT_BY_QUALITY[quality], quality
+    
+    elif platform == 'instagram':
+        # Instagram - quality parameter is ignored, always get best
+        return 'best', 'best'  # 'best' quality for consistent response
+    
+    else:
+        raise ValueError("Unsupported platform. Only YouTube and Instagram URLs are supported.")
+
+def build_filename(video_title, platform, quality):
+    """
+    Build the download filename from the video title
+    """
+    # Clean filename for download
+    clean_title = _BAD_CHARS.sub('', video_title).rstrip()
+    
+    if platform != 'youtube':
+        return f"{clean_title}_instagram.mp4"
+    
+    # Heights get a "p" suffix; best and worst are used as-is
+    if quality.isdigit():
+        return f"{clean_title}_{quality}p.mp4"
+    return f"{clean_title}_{quality}.mp4"
+
+def attachment_disposition(filename):
+    """
+    Get Content-Disposition options for a possibly non-ASCII filename (RFC 5987)
+    """
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simple, 'filename*': f"UTF-8''{quote(filename, safe='!#$&+-.^_`|~')}"}
+    return {'filename': filename}
+
+def stream_video_direct(video_url, quality=None, cookies_file=None):
+    """
+    Stream video directly from yt-dlp's stdout without writing it to disk
+    Returns None when the selected formats need merging, since ffmpeg can only
+    pipe merged output as MPEG-TS rather than mp4
+    """
+    platform = detect_platform(video_url)
+    format_spec, quality = select_format(platform, quality)
+    
+    # Auto-find cookies file
+    actual_cookies_file = find_cookies_file(cookies_file)
+    
+    ydl_opts = {
+        'format': format_spec,
+        'quiet': True,
+        'no_warnings': False,
+    }
+    
+    if actual_cookies_file:
+        ydl_opts['cookiefile'] = actual_cookies_file
+    
+    # Run format selection against the cached metadata
+    info = get_info(video_url, actual_cookies_file)
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        selected = ydl.process_ie_result(copy.deepcopy(info), download=False)
+    
+    if selected.get('requested_formats'):
+        return None
+    
+    cmd = [
+        sys.executable, '-m', 'yt_dlp',
+        '--ignore-config',  # Match the in-process YoutubeDL, which reads no config files
+        '--load-info-json', '-',
+        '--format', selected['format_id'],
+        '--output', '-',
+        '--quiet',
+    ]
+    if actual_cookies_file:
+        cmd += ['--cookies', actual_cookies_file]
+    
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    # Keep the tail of yt-dlp's stderr for error messages; drain it continuously
+    # so a chatty child can never block on a full pipe mid-stream
+    stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+    stderr_reader = threading.Thread(
+        target=lambda: stderr_tail.extend(line.decode('utf-8', 'replace').rstrip() for line in proc.stderr),
+        daemon=True,
+    )
+    stderr_reader.start()
+    
+    def child_error():
+        stderr_reader.join(timeout=5)
+        errors = [line for line in stderr_tail if line.startswith('ERROR:')]
+        return '\n'.join(errors or stderr_tail) or f"yt-dlp exited with code {proc.returncode}"
+    
+    try:
+        # yt-dlp reads the whole info JSON before it starts writing to stdout
+        proc.stdin.write(json.dumps(info).encode('utf-8'))
+        proc.stdin.close()
+        
+        # Wait for the first chunk so early failures still surface as errors
+        first_chunk = proc.stdout.read1(STREAM_CHUNK_SIZE)
+        if not first_chunk:
+            proc.wait()
+            raise RuntimeError(child_error())
+    except Exception:
+        proc.kill()
+        proc.wait()
+        raise
+    
+    def generate():
+        try:
+            yield first_chunk
+            yield from iter(lambda: proc.stdout.read1(STREAM_CHUNK_SIZE), b'')
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            if proc.wait() > 0:
+                logger.error("Stream error: %s", child_error())
+            logger.info("Stream closed")
+    
+    logger.info("Streaming from %s: %s in %s", platform, info.get('title', 'Unknown'), quality)
+    return generate(), info.get('title', 'video'), platform
 
 def download_video_direct(video_url, quality=None, cookies_file=None):
     """
     Download video directly with specified quality and cookies
     """
     platform = detect_platform(video_url)
+    format_spec, quality = select_format(platform, quality)
     
     # Auto-find cookies file
     actual_cookies_file = find_cookies_file(cookies_file)
     
-    # Create temp directory for download
-    temp_dir = tempfile.mkdtemp()
+    # Take a scratch directory for the download
+    temp_dir = acquire_scratch_dir()
     
     ydl_opts = {
         'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
+        'format': format_spec,
         'quiet': True,
         'no_warnings': False,
     }
@@ -70,49 +499,92 @@ def download_video_direct(video_url, quality=None, cookies_file=None):
     # Add cookies if available
     if actual_cookies_file:
         ydl_opts['cookiefile'] = actual_cookies_file
-        logger.info(f"Using cookies from: {actual_cookies_file}")
+        logger.info("Using cookies from: %s", actual_cookies_file)
     else:
         logger.info("No cookies file found, proceeding without cookies")
     
-    # Set format based on platform
-    if platform == 'youtube':
-        if not quality:
-            quality = 'best'
-            
-        if quality not in SUPPORTED_QUALITIES:
-            raise ValueError(f"Unsupported quality. Use: {', '.join(SUPPORTED_QUALITIES)}")
-        
-        # YouTube format selection
-        if quality == 'best':
-            ydl_opts['format'] = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-        elif quality == 'worst':
-            ydl_opts['format'] = 'worstvideo[ext=mp4]+worstaudio[ext=m4a]/worst[ext=mp4]/worst'
-        else:
-            # Specific quality (144, 240, 360, 480, 540, 720, 1080, etc.)
-            ydl_opts['format'] = f'bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]/best[height<={quality}][ext=mp4]/best'
-    
-    elif platform == 'instagram':
-        # Instagram - quality parameter is ignored, always get best
-        ydl_opts['format'] = 'best'
-        quality = 'best'  # For consistent response
-    
-    else:
-        raise ValueError("Unsupported platform. Only YouTube and Instagram URLs are supported.")
-    
     try:
+        cached_info = get_info(video_url, actual_cookies_file)
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=True)
+            # Resolve formats from the cached metadata instead of extracting again
+            info = ydl.process_ie_result(copy.deepcopy(cached_info), download=True)
             downloaded_file = ydl.prepare_filename(info)
             
-            logger.info(f"Successfully downloaded from {platform}: {info.get('title', 'Unknown')} in {quality}")
+            logger.info("Successfully downloaded from %s: %s in %s", platform, info.get('title', 'Unknown'), quality)
             return downloaded_file, info.get('title', 'video'), platform
             
     except Exception as e:
         # Cleanup on error
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        logger.error(f"Download error: {str(e)}")
+        release_scratch_dir(temp_dir)
+        logger.error("Download error: %s", e)
         raise e
 
+def cleanup_download(downloaded_file):
+    """
+    Empty the scratch directory holding a downloaded file and return it to the pool
+    """
+    try:
+        release_scratch_dir(os.path.dirname(downloaded_file))
+        logger.info("Cleaned up temporary files")
+    except Exception as e:
+        logger.error("Cleanup error: %s", e)
+
+def cleanup_future(future):
+    """
+    Remove the download produced by a batch task nobody will consume
+    """
+    if not future.cancelled() and future.exception() is None:
+        cleanup_download(future.result()[0])
+
+@contextlib.contextmanager
+def shared_download(video_url, quality=None, cookies_file=None):
+    """
+    Download a video once for all concurrent identical requests
+    Yields (downloaded_file, title, platform); the file is cleaned up once the
+    last request sharing it leaves the block
+    """
+    _, quality = select_format(detect_platform(video_url), quality)
+    key = (canonicalize_youtube_id(video_url), quality, find_cookies_file(cookies_file))
+    
+    with _INFLIGHT_LOCK:
+        entry = _INFLIGHT.get(key)
+        leader = entry is None
+        if leader:
+            entry = _INFLIGHT[key] = {'future': Future(), 'users': 0}
+        entry['users'] += 1
+    
+    if leader:
+        try:
+            entry['future'].set_result(download_video_direct(video_url, quality, cookies_file))
+        except Exception as e:
+            entry['future'].set_exception(e)
+        finally:
+            # Later requests start a fresh download
+            with _INFLIGHT_LOCK:
+                del _INFLIGHT[key]
+    else:
+        logger.info("Joining in-flight download: %s in %s", video_url, quality)
+    
+    try:
+        yield entry['future'].result()
+    finally:
+        with _INFLIGHT_LOCK:
+            entry['users'] -= 1
+            last_user = entry['users'] == 0
+        if last_user and entry['future'].exception() is None:
+            cleanup_download(entry['future'].result()[0])
+
+def cached_json(data, ttl=INFO_CACHE_TTL):
+    """
+    JSON response with an ETag and Cache-Control so clients and CDNs can reuse it
+    Answers 304 Not Modified when the request's If-None-Match matches
+    """
+    response = jsonify(data)
+    response.set_etag(hashlib.blake2b(response.get_data(), digest_size=8).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = ttl
+    return response.make_conditional(request)
+
 @app.route('/api/video/download', methods=['GET'])
 def direct_download():
     """
@@ -122,72 +594,163 @@ def direct_download():
     - quality: For YouTube: 144, 240, 360, 480, 540, 720, 1080, 1440, 2160, best, worst (optional)
     - cookies: Path to cookies file (optional - auto-detects cookies.txt)
     """
-    video_url = request.args.get('url')
+    video_url = request.args.get('url', '').strip()
     quality = request.args.get('quality')
     cookies_file = request.args.get('cookies')
     
     if not video_url:
         return "Error: Video URL parameter is required", 400
     
+    # Reject bad input before it reaches yt-dlp
     platform = detect_platform(video_url)
+    if platform == 'unknown':
+        return "Error: Invalid video URL. Only YouTube and Instagram video URLs are supported", 400
     
     # Validate quality for YouTube
     if platform == 'youtube' and quality and quality not in SUPPORTED_QUALITIES:
-        return f"Error: Unsupported quality for YouTube. Use: {', '.join(SUPPORTED_QUALITIES)}", 400
+        return f"Error: Unsupported quality for YouTube. Use: {SUPPORTED_QUALITIES_STR}", 400
     
     # Instagram doesn't need quality parameter
     if platform == 'instagram' and quality:
         logger.info("Quality parameter ignored for Instagram")
     
+    # Name the file after the quality actually selected, not the raw parameter
+    _, effective_quality = select_format(platform, quality)
+    
     try:
-        downloaded_file, video_title, platform = download_video_direct(video_url, quality, cookies_file)
+        # Pipe single-file formats straight to the client
+        stream = stream_video_direct(video_url, quality, cookies_file)
+        if stream is not None:
+            chunks, video_title, platform = stream
+            response = Response(stream_with_context(chunks), mimetype='video/mp4')
+            response.headers.set(
+                'Content-Disposition', 'attachment',
+                **attachment_disposition(build_filename(video_title, platform, effective_quality))
+            )
+            return response
         
-        # Clean filename for download
-        clean_title = "".join(c for c in video_title if c.isalnum() or c in (' ', '-', '_')).rstrip()
-        
-        if platform == 'youtube':
-            filename = f"{clean_title}_{quality}p.mp4"
-        else:
-            filename = f"{clean_title}_instagram.mp4"
-        
-        # Send file for download
-        response = send_file(
-            downloaded_file,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='video/mp4'
-        )
-        
-        # Cleanup temp directory after response
-        @response.call_on_close
-        def cleanup():
-            try:
-                dir_path = os.path.dirname(downloaded_file)
-                shutil.rmtree(dir_path, ignore_errors=True)
-                logger.info("Cleaned up temporary files")
-            except Exception as e:
-                logger.error(f"Cleanup error: {str(e)}")
+        # Merged formats are downloaded to disk first, once per concurrent identical request
+        with shared_download(video_url, quality, cookies_file) as (downloaded_file, video_title, platform):
+            # Send file for download; send_file hands the open file to the WSGI
+            # server's file wrapper, which gunicorn serves with sendfile(2)
+            response = send_file(
+                downloaded_file,
+                as_attachment=True,
+                download_name=build_filename(video_title, platform, effective_quality),
+                mimetype='video/mp4'
+            )
         
+        # The file is already open, so leaving the block can free its scratch directory
+        # right away (call_on_close never fires for send_file's passthrough responses)
         return response
         
+    except ScratchSpaceBusy as e:
+        return f"Error downloading video: {str(e)}", 503
     except Exception as e:
         return f"Error downloading video: {str(e)}", 500
 
+@app.route('/api/video/batch', methods=['POST'])
+def batch_download():
+    """
+    Download several videos in parallel and stream them back as one ZIP archive
+    JSON body (or a plain JSON array of URLs):
+    - urls: List of YouTube/Instagram video URLs (required)
+    - quality: For YouTube: 144, 240, 360, 480, 540, 720, 1080, 1440, 2160, best, worst (optional)
+    - cookies: Path to cookies file (optional - auto-detects cookies.txt)
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, list):
+        data = {'urls': data}
+    elif not isinstance(data, dict):
+        data = {}
+    
+    urls = data.get('urls')
+    if isinstance(urls, list):
+        urls = [url.strip() if isinstance(url, str) else url for url in urls]
+    quality = data.get('quality')
+    cookies_file = data.get('cookies')
+    
+    if not urls or not isinstance(urls, list) or not all(isinstance(url, str) and url for url in urls):
+        return "Error: JSON list of video URLs is required", 400
+    
+    if len(urls) > BATCH_MAX_URLS:
+        return f"Error: At most {BATCH_MAX_URLS} URLs per batch", 400
+    
+    invalid_urls = [url for url in urls if detect_platform(url) == 'unknown']
+    if invalid_urls:
+        return f"Error: Invalid video URLs: {', '.join(invalid_urls)}", 400
+    
+    if quality is not None and not isinstance(quality, str):
+        return f"Error: quality must be a string. Use: {SUPPORTED_QUALITIES_STR}", 400
+    
+    if cookies_file is not None and not isinstance(cookies_file, str):
+        return "Error: cookies must be a path string", 400
+    
+    if quality and quality not in SUPPORTED_QUALITIES:
+        return f"Error: Unsupported quality for YouTube. Use: {SUPPORTED_QUALITIES_STR}", 400
+    
+    # Each task runs its own YoutubeDL instance
+    futures = {
+        _POOL.submit(download_video_direct, url, quality, cookies_file): (index, url)
+        for index, url in enumerate(urls, 1)
+    }
+    
+    def generate():
+        zs = ZipStream()
+        errors = []
+        pending = set(futures)
+        try:
+            # Stream each video as soon as its download finishes
+            for future in as_completed(futures):
+                pending.discard(future)
+                index, url = futures[future]
+                try:
+                    downloaded_file, video_title, platform = future.result()
+                except Exception as e:
+                    errors.append(f"{url}: {str(e)}")
+                    continue
+                
+                # Index prefix keeps names unique when titles repeat
+                _, effective_quality = select_format(platform, quality)
+                arcname = f"{index:02d}_{build_filename(video_title, platform, effective_quality)}"
+                zs.add_path(downloaded_file, arcname)
+                try:
+                    yield from zs.all_files()
+                finally:
+                    cleanup_download(downloaded_file)
+            
+            if errors:
+                zs.add('\n'.join(errors) + '\n', 'errors.txt')
+            yield from zs.finalize()
+            logger.info("Batch finished: %d of %d videos", len(urls) - len(errors), len(urls))
+        finally:
+            # Client went away early - drop pending work and clean up finished downloads
+            for future in pending:
+                if not future.cancel():
+                    future.add_done_callback(cleanup_future)
+    
+    response = Response(stream_with_context(generate()), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename='videos.zip')
+    return response
+
 @app.route('/api/video/formats', methods=['GET'])
 def available_formats():
     """
     Get available formats for a video (YouTube only)
     """
-    video_url = request.args.get('url')
+    video_url = request.args.get('url', '').strip()
     cookies_file = request.args.get('cookies')
     
     if not video_url:
         return jsonify({'error': 'Video URL is required'}), 400
     
+    # Reject bad input before it reaches yt-dlp
     platform = detect_platform(video_url)
+    if platform == 'unknown':
+        return jsonify({'error': 'Invalid video URL. Only YouTube and Instagram video URLs are supported'}), 400
     
     if platform != 'youtube':
-        return jsonify({
+        return cached_json({
             'platform': platform,
             'message': 'Formats endpoint only available for YouTube videos',
             'supported_qualities': ['best']  # Instagram always uses best quality
@@ -196,46 +759,39 @@ def available_formats():
     # Auto-find cookies file
     actual_cookies_file = find_cookies_file(cookies_file)
     
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': False,
-    }
-    
-    if actual_cookies_file:
-        ydl_opts['cookiefile'] = actual_cookies_file
-    
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=False)
-            
-            formats = []
-            for fmt in info.get('formats', []):
-                if fmt.get('vcodec') != 'none':  # Video formats only (no audio-only)
-                    formats.append({
-                        'format_id': fmt.get('format_id'),
-                        'resolution': f"{fmt.get('height', 'N/A')}p",
-                        'ext': fmt.get('ext'),
-                        'filesize': fmt.get('filesize'),
-                        'format_note': fmt.get('format_note', 'N/A'),
-                        'quality_label': f"{fmt.get('height', 'N/A')}p"
-                    })
-            
-            # Get unique available qualities
-            available_qualities = list(set([
-                f['quality_label'] for f in formats 
-                if f['quality_label'] != 'N/Ap' and f['quality_label'].replace('p', '').isdigit()
-            ]))
-            available_qualities.sort(key=lambda x: int(x.replace('p', '')))
-            
-            return jsonify({
-                'platform': 'youtube',
-                'title': info.get('title'),
-                'duration': info.get('duration'),
-                'available_qualities': available_qualities,
-                'cookies_used': bool(actual_cookies_file),
-                'formats_count': len(formats)
+        info = get_info(video_url, actual_cookies_file)
+        
+        # Collect video formats and their unique heights in one pass
+        formats = []
+        heights = set()
+        for fmt in info.get('formats', ()):
+            if fmt.get('vcodec') == 'none':  # Video formats only (no audio-only)
+                continue
+            height = fmt.get('height')
+            label = f"{height if height is not None else 'N/A'}p"
+            formats.append({
+                'format_id': fmt.get('format_id'),
+                'resolution': label,
+                'ext': fmt.get('ext'),
+                'filesize': fmt.get('filesize'),
+                'format_note': fmt.get('format_note', 'N/A'),
+                'quality_label': label
             })
-            
+            if isinstance(height, int):
+                heights.add(height)
+        
+        available_qualities = [f"{height}p" for height in sorted(heights)]
+        
+        return cached_json({
+            'platform': 'youtube',
+            'title': info.get('title'),
+            'duration': info.get('duration'),
+            'available_qualities': available_qualities,
+            'cookies_used': bool(actual_cookies_file),
+            'formats_count': len(formats)
+        })
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -244,47 +800,41 @@ def video_info():
     """
     Get basic video information for both YouTube and Instagram
     """
-    video_url = request.args.get('url')
+    video_url = request.args.get('url', '').strip()
     cookies_file = request.args.get('cookies')
     
     if not video_url:
         return jsonify({'error': 'Video URL is required'}), 400
     
+    # Reject bad input before it reaches yt-dlp
     platform = detect_platform(video_url)
+    if platform == 'unknown':
+        return jsonify({'error': 'Invalid video URL. Only YouTube and Instagram video URLs are supported'}), 400
     
     # Auto-find cookies file
     actual_cookies_file = find_cookies_file(cookies_file)
     
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': False,
-    }
-    
-    if actual_cookies_file:
-        ydl_opts['cookiefile'] = actual_cookies_file
-    
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=False)
-            
-            response_data = {
-                'platform': platform,
-                'title': info.get('title'),
-                'duration': info.get('duration'),
-                'uploader': info.get('uploader'),
-                'view_count': info.get('view_count'),
-                'thumbnail': info.get('thumbnail'),
-                'cookies_used': bool(actual_cookies_file),
-                'url': video_url
-            }
-            
-            if platform == 'youtube':
-                response_data['supported_qualities'] = SUPPORTED_QUALITIES
-            else:
-                response_data['message'] = 'Instagram videos download in best available quality'
-            
-            return jsonify(response_data)
-            
+        info = get_info(video_url, actual_cookies_file)
+        
+        response_data = {
+            'platform': platform,
+            'title': info.get('title'),
+            'duration': info.get('duration'),
+            'uploader': info.get('uploader'),
+            'view_count': info.get('view_count'),
+            'thumbnail': info.get('thumbnail'),
+            'cookies_used': bool(actual_cookies_file),
+            'url': video_url
+        }
+        
+        if platform == 'youtube':
+            response_data['supported_qualities'] = list(QUALITY_ORDER)
+        else:
+            response_data['message'] = 'Instagram videos download in best available quality'
+        
+        return cached_json(response_data)
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -294,11 +844,11 @@ def check_cookies():
     Check if cookies file is available
     """
     cookies_file = find_cookies_file()
-    return jsonify({
+    return cached_json({
         'cookies_available': bool(cookies_file),
         'cookies_file': cookies_file,
         'supported_cookies_files': COOKIES_FILES
-    })
+    }, ttl=CHECK_COOKIES_MAX_AGE)
 
 @app.route('/')
 def home():
@@ -309,6 +859,7 @@ def home():
     <h2>Available endpoints:</h2>
     <ul>
         <li><strong>Direct Download:</strong> GET /api/video/download?url=URL&quality=720</li>
+        <li><strong>Batch Download (ZIP):</strong> POST /api/video/batch with JSON {"urls": [URL, ...], "quality": "720"}</li>
         <li><strong>Video Info:</strong> GET /api/video/info?url=URL</li>
         <li><strong>YouTube Formats:</strong> GET /api/video/formats?url=YOUTUBE_URL</li>
         <li><strong>Check Cookies:</strong> GET /api/check-cookies</li>
@@ -336,4 +887,5 @@ if __name__ == '__main__':
         print("⚠️  No cookies file found. Age-restricted videos may not work.")
     
     print("🚀 Video Download API started - Supports YouTube & Instagram")
-    app.run(debug=True, host='0.0.0.0', port=8080)
+    # Local development only; production runs under gunicorn (see gunicorn_conf.py)
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)), threaded=True)
@@ -0,0 +1,25 @@
+# Gunicorn configuration
+# Run with: gunicorn -c gunicorn_conf.py app:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Worker model, set with GUNICORN_WORKER_CLASS:
+# - 'gthread' (default): a thread per request, so a long download doesn't
+#   block other requests; downloaded files are served with sendfile(2)
+# - 'gevent': each worker multiplexes up to worker_connections requests on
+#   one event loop, so hundreds of concurrent /info and /formats calls
+#   waiting on YouTube share a single process; files are copied through
+#   user space instead of sendfile(2)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = 8
+worker_connections = 1000
+
+# Long video downloads can keep a request open for minutes
+timeout = 600
+
+# Serve downloaded files with sendfile(2) instead of copying through Python
+sendfile = True